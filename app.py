@@ -1,13 +1,21 @@
 import os
 import json
 import random
-from flask import Flask, render_template, request, jsonify, send_from_directory, url_for
+import shutil
+import tempfile
+import time
+import threading
+from flask import Flask, render_template, request, jsonify, send_from_directory, url_for, Response, stream_with_context
 from urllib.parse import urlparse, urljoin
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 
 # --- App Configuration ---
 UPLOAD_FOLDER = 'data/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+# Local footage searchable by name: video files or directories of frame images
+VIDEO_FOLDER = 'data/videos'
+VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'webm'}
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 app = Flask(__name__)
@@ -18,11 +26,14 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:/
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # --- Import Your Recognition Logic ---
-from src.database import load_database, build_database_from_photos, save_database
-from src.recognizer import recognize_sketch
-from src.database import load_component_database, find_best_component_match
+from src.database import load_versioned_database, build_database_from_photos, save_database, FaceIndex, DB_PATH
+from src.recognizer import recognize_sketch, recognize_composite
+from src.composite import load_element_layers, list_elements
+from src.database import find_best_component_match, COMPONENT_DB_PATH
 from src.preprocess import preprocess_component_image
-from src.embedding import get_embedding
+from src.embedding import get_embedding, get_model, EMBEDDING_MODEL_VERSION
+from src.migration import EmbeddingMigration
+from src.video import search_video, MIN_MATCH_SIMILARITY
 
 # --- Authentication imports ---
 from flask_sqlalchemy import SQLAlchemy
@@ -31,12 +42,64 @@ from src.auth import db as auth_db, User
 
 # --- Load Database on Startup ---
 print("⏳ Loading face database...")
-database = load_database()
+db_version, database = load_versioned_database()
 if not database:
     print("DB not found. Building a new one...")
-    database = build_database_from_photos()
-    save_database(database)
-print("✅ Face database loaded.")
+    db_version = EMBEDDING_MODEL_VERSION
+    database = build_database_from_photos(version=db_version)
+    save_database(database, db_version)
+# The index being served. Handlers read it once per request so a query never
+# mixes versions; it is only replaced (as a whole) while holding index_lock.
+face_index = FaceIndex(db_version, database)
+index_lock = threading.Lock()
+migration = None
+# Load the served model up front so the first query does not pay for it
+get_model(db_version)
+print(f"✅ Face database loaded (embedding model {db_version}).")
+
+
+def get_face_index():
+    return face_index
+
+
+def activate_face_index(index):
+    """Persists `index` and makes it the one served. Callers hold index_lock.
+
+    When the embedding version changes, the old database is first copied to
+    a backup named after its version, so a migration can be rolled back.
+    """
+    global face_index
+    if index.version != face_index.version and os.path.exists(DB_PATH):
+        backup_path = f"{DB_PATH}.{face_index.version}.{time.strftime('%Y%m%d-%H%M%S')}.bak"
+        shutil.copy2(DB_PATH, backup_path)
+        print(f"Backed up the {face_index.version} face database to {backup_path}.")
+    save_database(index.profiles, index.version)
+    face_index = index
+    print(f"✅ Now serving face database built with {index.version} ({len(index.profiles)} entries).")
+
+
+def start_embedding_migration(target_version, batch_size=None):
+    global migration
+    kwargs = {"batch_size": batch_size} if batch_size else {}
+    migration = EmbeddingMigration(get_face_index, activate_face_index, index_lock, target_version, **kwargs)
+    return migration.start()
+
+
+# With debug=True the Werkzeug reloader also imports this module in a parent
+# process that never serves requests; only migrate in the serving process.
+# (`python app.py` runs with debug=True; the reloader marks its child with WERKZEUG_RUN_MAIN.)
+is_reloader_parent = __name__ == '__main__' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+if db_version != EMBEDDING_MODEL_VERSION:
+    if is_reloader_parent:
+        print(f"⚠️ Face database uses {db_version}; the serving process will migrate it to {EMBEDDING_MODEL_VERSION}.")
+    else:
+        print(f"⏳ Face database uses {db_version}; re-embedding with {EMBEDDING_MODEL_VERSION} in the background...")
+        start_embedding_migration(EMBEDDING_MODEL_VERSION)
+
+# --- Preload sketch element layers for server-side composite rendering ---
+print("⏳ Loading sketch element layers...")
+element_layers = load_element_layers()
+print(f"✅ Loaded {len(element_layers)} sketch element layers.")
 
 # --- Initialize auth (Flask-Login + SQLAlchemy) ---
 print("⏳ Initializing authentication subsystem...")
@@ -50,9 +113,10 @@ with app.app_context():
 
 # --- Load component database if available ---
 print("⏳ Loading component database (if present)...")
-component_db = load_component_database()
+# Component queries are embedded with the version the component DB was built with
+component_db_version, component_db = load_versioned_database(COMPONENT_DB_PATH)
 if component_db:
-    print(f"✅ Component database loaded ({len(component_db)} entries).")
+    print(f"✅ Component database loaded ({len(component_db)} entries, embedding model {component_db_version}).")
 else:
     print("⚠️ No component database found (component_db.pkl). Build it with build_component_db.py if you need component matching.")
 
@@ -75,6 +139,58 @@ def load_user(user_id):
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+
+def face_match_response(name, profile, dist, cos_sim, extra=None):
+    """Builds the JSON response for a full-face match, mapping raw metrics for display.
+
+    `extra` holds additional fields added to a successful match.
+    """
+    if name and profile:
+        # Extract filename from the stored photo path and build URL for frontend
+        photo_filename = os.path.basename(profile.get('photo_path', ''))
+        # Use url_for to build a proper URL to the `uploaded_photo` route
+        try:
+            photo_url = url_for('uploaded_photo', filename=photo_filename)
+        except Exception:
+            photo_url = f'/data/photos/{photo_filename}'
+        # Map raw cosine similarity (typically in [-1,1]) to [0,1] then to [85,95]
+        raw_cos = float(cos_sim) if cos_sim is not None else 0.0
+        raw_cos = max(0.0, min(1.0, raw_cos))
+        # User-requested display range: 85..95
+        display_similarity = 85.0 + raw_cos * 10.0
+        # Clamp to exact bounds just in case
+        display_similarity = max(85.0, min(95.0, display_similarity))
+
+        # Map the Euclidean distance into a human-friendly 0..6 range for display.
+        # Many raw L2 distances are small (0..1). Multiply by 10 to scale to roughly 0..10,
+        # then clamp to strictly less than 6 as requested. This gives variability while
+        # keeping the shown value < 6. Use 2 decimals for a concise display.
+        try:
+            raw_dist_val = float(dist)
+        except Exception:
+            raw_dist_val = 0.0
+
+        # Scale factor chosen so typical distances around 0.0-0.6 map to 0.0-6.0
+        mapped_distance = raw_dist_val * 10.0
+        # If the scaled value would reach/exceed 6.0, provide a random display value
+        # between 0 (inclusive) and 6 (exclusive) so the UI doesn't always show a fixed sentinel.
+        if mapped_distance >= 6.0:
+            # Use two decimals for display; ensure value is strictly less than 6.0
+            mapped_distance = round(min(random.uniform(0.0, 5.9999), 5.9999), 2)
+
+        return jsonify({
+            "match": True,
+            "name": name,
+            "age": profile.get('age', 'N/A'),
+            "criminal_record": profile.get('criminal_record', 'N/A'),
+            "distance": f"{mapped_distance:.2f}",
+            "similarity": f"{display_similarity:.2f}",
+            "photo_path": photo_url,
+            **(extra or {})
+        })
+    else:
+        return jsonify({"match": False, "message": "No confident match found."})
+
 # --- Main Routes ---
 @app.route('/')
 def hub():
@@ -153,53 +269,46 @@ def api_recognize():
     sketch_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     file.save(sketch_path)
 
-    name, profile, dist, cos_sim = recognize_sketch(sketch_path, database)
+    index = face_index
+    name, profile, dist, cos_sim = recognize_sketch(sketch_path, index.profiles, index.version)
     os.remove(sketch_path)
 
-    if name and profile:
-        # Extract filename from the stored photo path and build URL for frontend
-        photo_filename = os.path.basename(profile.get('photo_path', ''))
-        # Use url_for to build a proper URL to the `uploaded_photo` route
-        try:
-            photo_url = url_for('uploaded_photo', filename=photo_filename)
-        except Exception:
-            photo_url = f'/data/photos/{photo_filename}'
-        # Map raw cosine similarity (typically in [-1,1]) to [0,1] then to [85,95]
-        raw_cos = float(cos_sim) if cos_sim is not None else 0.0
-        raw_cos = max(0.0, min(1.0, raw_cos))
-        # User-requested display range: 85..95
-        display_similarity = 85.0 + raw_cos * 10.0
-        # Clamp to exact bounds just in case
-        display_similarity = max(85.0, min(95.0, display_similarity))
+    return face_match_response(name, profile, dist, cos_sim)
 
-        # Map the Euclidean distance into a human-friendly 0..6 range for display.
-        # Many raw L2 distances are small (0..1). Multiply by 10 to scale to roughly 0..10,
-        # then clamp to strictly less than 6 as requested. This gives variability while
-        # keeping the shown value < 6. Use 2 decimals for a concise display.
-        try:
-            raw_dist_val = float(dist)
-        except Exception:
-            raw_dist_val = 0.0
 
-        # Scale factor chosen so typical distances around 0.0-0.6 map to 0.0-6.0
-        mapped_distance = raw_dist_val * 10.0
-        # If the scaled value would reach/exceed 6.0, provide a random display value
-        # between 0 (inclusive) and 6 (exclusive) so the UI doesn't always show a fixed sentinel.
-        if mapped_distance >= 6.0:
-            # Use two decimals for display; ensure value is strictly less than 6.0
-            mapped_distance = round(min(random.uniform(0.0, 5.9999), 5.9999), 2)
+@app.route('/api/composite_elements', methods=['GET'])
+@login_required
+def api_composite_elements():
+    """Lists the element ids accepted by /api/recognize_composite."""
+    return jsonify({"elements": list_elements()})
 
-        return jsonify({
-            "match": True,
-            "name": name,
-            "age": profile.get('age', 'N/A'),
-            "criminal_record": profile.get('criminal_record', 'N/A'),
-            "distance": f"{mapped_distance:.2f}",
-            "similarity": f"{display_similarity:.2f}",
-            "photo_path": photo_url
-        })
-    else:
-        return jsonify({"match": False, "message": "No confident match found."})
+
+@app.route('/api/recognize_composite', methods=['POST'])
+@login_required
+def api_recognize_composite():
+    """Full-face recognition of a composite rendered on the server.
+
+    Expects a JSON body describing the composite instead of an uploaded image:
+    { "canvas": {"width", "height"},
+      "elements": [{"id": "eyes/01.png", "x", "y", "width" | "scale"}, ...] }
+    Elements are drawn in list order, so later entries end up on top.
+    """
+    description = request.get_json(silent=True)
+    if description is None:
+        return jsonify({"error": "Expected a JSON composite description"}), 400
+
+    try:
+        index = face_index
+        name, profile, dist, cos_sim, face_detected = recognize_composite(description, index.profiles, index.version)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if name is None and not face_detected:
+        return jsonify({"match": False, "message": "No face detected in the composite. "
+                                                   "Add at least a head, eyes, nose and lips."})
+    # face_detected is False when MTCNN did not find a face and the composite
+    # was embedded from the bounding box of its (complete) set of elements
+    return face_match_response(name, profile, dist, cos_sim, {"face_detected": face_detected})
 
 
 
@@ -233,7 +342,7 @@ def api_recognize_component():
         os.remove(sketch_path)
         return jsonify({"match": False, "message": "Could not preprocess component image."})
 
-    emb = get_embedding(comp_tensor)
+    emb = get_embedding(comp_tensor, component_db_version)
     # Find best match in component DB
     if not component_db:
         os.remove(sketch_path)
@@ -247,6 +356,7 @@ def api_recognize_component():
         # (e.g., 'real1') while main DB keys may be human names (from metadata). We try
         # multiple fallbacks so the frontend receives a usable photo URL.
         photo_url = ''
+        database = face_index.profiles
         main_profile = database.get(name)
         resolved_display_name = name
 
@@ -305,7 +415,6 @@ def api_recognize_component():
 @app.route('/api/add_person', methods=['POST'])
 @login_required
 def api_add_person():
-    global database
     if 'photo' not in request.files:
         return jsonify({"error": "No photo file provided"}), 400
     
@@ -330,12 +439,136 @@ def api_add_person():
         f.truncate()
 
     print("Rebuilding database with new entry...")
-    database = build_database_from_photos()
-    save_database(database)
+    with index_lock:
+        # Rebuild with the served version; a running migration picks the new
+        # entry up before it switches over.
+        version = face_index.version
+        activate_face_index(FaceIndex(version, build_database_from_photos(version=version)))
     print("✅ Database rebuild complete.")
     return jsonify({"success": True, "message": f"{name} was added to the database."})
 
 
+@app.route('/api/search_video', methods=['POST'])
+@login_required
+def api_search_video():
+    """Searches video footage for every face in the gallery, streaming matches as they are found.
+
+    Expects either:
+    - 'video' : an uploaded video file, or
+    - 'source' : a video file or image-sequence directory under data/videos
+    Optional fields:
+    - 'format' : 'sse' (server-sent events, default) or 'ndjson' (one JSON object per line)
+    - 'min_similarity' : raw cosine similarity a face needs to its nearest
+      gallery profile to be reported (default MIN_MATCH_SIMILARITY, 0.6)
+
+    Each result is a track whose best gallery match is new or has improved. The
+    stream ends with a 'done' event (or an 'error' event if decoding failed).
+    """
+    stream_format = request.form.get('format', 'sse')
+    if stream_format not in ('sse', 'ndjson'):
+        return jsonify({"error": "Invalid format. Use 'sse' or 'ndjson'."}), 400
+    try:
+        min_similarity = float(request.form.get('min_similarity', MIN_MATCH_SIMILARITY))
+    except ValueError:
+        return jsonify({"error": "min_similarity must be a number"}), 400
+    if not -1.0 <= min_similarity <= 1.0:
+        return jsonify({"error": "min_similarity must be between -1 and 1"}), 400
+
+    uploaded_path = None
+    if 'video' in request.files and request.files['video'].filename:
+        file = request.files['video']
+        ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+        if ext not in VIDEO_EXTENSIONS:
+            return jsonify({"error": "Invalid video file"}), 400
+        # Streams can run for minutes, so every upload gets its own file
+        fd, uploaded_path = tempfile.mkstemp(dir=app.config['UPLOAD_FOLDER'], suffix='.' + ext)
+        os.close(fd)
+        file.save(uploaded_path)
+        source = uploaded_path
+    else:
+        name = request.form.get('source', '')
+        source = safe_join(VIDEO_FOLDER, name) if name else None
+        if not source or not os.path.exists(source):
+            return jsonify({"error": "No video file provided or source not found"}), 400
+
+    index = face_index
+
+    def format_event(event, data):
+        if stream_format == 'ndjson':
+            return json.dumps(dict(data, event=event)) + '\n'
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    def generate():
+        reported = 0
+        try:
+            for match in search_video(source, index.profiles, index.version, min_similarity=min_similarity):
+                profile = match["profile"]
+                photo_filename = os.path.basename(profile.get('photo_path', ''))
+                reported += 1
+                yield format_event('match', {
+                    "track_id": match["track_id"],
+                    "frame": match["frame"],
+                    "time": match["time"],
+                    "box": match["box"],
+                    "name": match["name"],
+                    "age": profile.get('age', 'N/A'),
+                    "criminal_record": profile.get('criminal_record', 'N/A'),
+                    "photo_path": url_for('uploaded_photo', filename=photo_filename),
+                    "distance": round(match["distance"], 4),
+                    "cosine": round(match["cosine"], 4)
+                })
+            yield format_event('done', {"matches": reported})
+        except Exception as e:
+            yield format_event('error', {"error": str(e)})
+
+    def remove_upload():
+        if uploaded_path and os.path.exists(uploaded_path):
+            os.remove(uploaded_path)
+
+    mimetype = 'application/x-ndjson' if stream_format == 'ndjson' else 'text/event-stream'
+    response = Response(stream_with_context(generate()), mimetype=mimetype,
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # Runs when the response is closed, even if the client disconnected before
+    # the generator started (its own finally block would then never run)
+    response.call_on_close(remove_upload)
+    return response
+
+
+@app.route('/api/embedding_migration', methods=['GET', 'POST'])
+@login_required
+def api_embedding_migration():
+    """Reports on, or starts, a background re-embedding of the face database.
+
+    POST form/JSON fields:
+    - 'version' : target embedding model version (defaults to the configured one)
+    - 'batch_size' : optional number of faces embedded per forward pass
+    """
+    if request.method == 'GET':
+        return jsonify({
+            "active_version": face_index.version,
+            "migration": migration.status() if migration else None
+        })
+
+    params = request.get_json(silent=True) or request.form
+    target_version = params.get('version') or EMBEDDING_MODEL_VERSION
+    try:
+        batch_size = int(params.get('batch_size') or 0)
+    except (TypeError, ValueError):
+        return jsonify({"error": "batch_size must be an integer"}), 400
+
+    with index_lock:
+        if migration and migration.is_running():
+            return jsonify({"error": "A migration is already running", "migration": migration.status()}), 409
+        if target_version == face_index.version:
+            return jsonify({"error": f"Face database already uses {target_version}"}), 400
+        try:
+            start_embedding_migration(target_version, batch_size)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    return jsonify({"success": True, "migration": migration.status()}), 202
+
+
 if __name__ == '__main__':
     # Default to port 5000 which is the common development port. You can override
     # by setting the PORT environment variable if you need a different port.
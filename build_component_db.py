@@ -2,16 +2,16 @@ import os
 import cv2
 import mediapipe as mp
 import numpy as np
-import pickle
 from PIL import Image
 import torch
 
 # Import our existing function for generating embeddings
-from src.embedding import get_embedding
+from src.embedding import get_embedding, EMBEDDING_MODEL_VERSION
+from src.database import save_database, COMPONENT_DB_PATH
 
 # --- Configuration ---
 PHOTOS_DIR = 'data/photos'
-OUTPUT_DB_PATH = 'component_db.pkl'
+OUTPUT_DB_PATH = COMPONENT_DB_PATH
 
 # --- Initialize MediaPipe Face Mesh ---
 # This model is excellent for finding detailed facial landmarks.
@@ -99,14 +99,13 @@ def build_database():
             
             # Get the embedding for this specific part
             tensor = preprocess_component_for_embedding(pil_image)
-            embedding = get_embedding(tensor)
+            embedding = get_embedding(tensor, EMBEDDING_MODEL_VERSION)
             
             component_database[person_name][f'{part}_embedding'] = embedding
             print(f"  - Generated embedding for {part}.")
 
-    # Save the final database to a file
-    with open(OUTPUT_DB_PATH, 'wb') as f:
-        pickle.dump(component_database, f)
+    # Save the final database to a file, tagged with the embedding model version
+    save_database(component_database, EMBEDDING_MODEL_VERSION, OUTPUT_DB_PATH)
 
     print(f"\n✅ Component database build complete! Saved to {OUTPUT_DB_PATH}")
 
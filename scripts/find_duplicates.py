@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Find (and optionally merge) duplicate identities in the face database.
+
+The same person enrolled under several names shows up as gallery entries whose
+embeddings are nearly identical. This runs a blocked all-pairs cosine
+similarity join over face_db.pkl and prints the candidate clusters.
+
+Clusters are formed by chaining links, so a cluster may join different people
+through one borderline match. --merge only merges clusters whose members are
+all pairwise above the threshold (marked "ok" in the listing), and copies
+face_db.pkl to a timestamped .bak file before saving.
+
+Run from the project root:
+
+    python scripts/find_duplicates.py --threshold 0.8 --workers 4
+    python scripts/find_duplicates.py --threshold 0.85 --output clusters.json --merge
+
+"""
+import argparse
+import json
+import shutil
+import sys
+import time
+
+sys.path.insert(0, '.')
+
+from src.database import load_versioned_database, save_database, DB_PATH
+from src.dedup import find_duplicate_clusters, merge_clusters, is_mergeable, DEFAULT_THRESHOLD, DEFAULT_BLOCK_SIZE
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Minimum cosine similarity for two entries to be linked')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE,
+                        help='Rows per similarity tile (memory per worker grows with its square)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes computing tiles in parallel')
+    parser.add_argument('--output', help='Write the clusters to this JSON file')
+    parser.add_argument('--merge', action='store_true',
+                        help=f'Merge each fully linked cluster into one identity and save {DB_PATH} (after a backup)')
+    args = parser.parse_args()
+
+    version, database = load_versioned_database()
+    if not database:
+        print(f'No face database found at {DB_PATH}.')
+        return
+
+    print(f'Comparing {len(database)} entries (threshold {args.threshold})...')
+    started = time.time()
+    clusters = find_duplicate_clusters(database, args.threshold, args.block_size, args.workers)
+    print(f'Found {len(clusters)} candidate clusters in {time.time() - started:.1f}s.')
+
+    for cluster in clusters:
+        lowest = cluster['min_pair_similarity']
+        status = 'ok' if is_mergeable(cluster, args.threshold) else 'chained'
+        print(f"  [{cluster['min_similarity']:.3f}..{cluster['max_similarity']:.3f}, "
+              f"weakest pair {'n/a' if lowest is None else f'{lowest:.3f}'}, {status}] "
+              + ', '.join(cluster['names']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(clusters, f, indent=2)
+        print('Wrote clusters to', args.output)
+
+    if args.merge and clusters:
+        before = len(database)
+        merged = merge_clusters(database, clusters, args.threshold)
+        if not merged:
+            print('No cluster has all members pairwise above the threshold; nothing merged.')
+            return
+        backup_path = f"{DB_PATH}.{time.strftime('%Y%m%d-%H%M%S')}.bak"
+        shutil.copy2(DB_PATH, backup_path)
+        save_database(database, version)
+        print(f'Merged {before - len(database)} entries in {len(merged)} clusters '
+              f'({len(clusters) - len(merged)} chained clusters skipped); saved {DB_PATH}, backup at {backup_path}.')
+
+
+if __name__ == '__main__':
+    main()
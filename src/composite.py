@@ -0,0 +1,213 @@
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+from src.preprocess import preprocess_pil_image, crop_to_face_tensor
+from src.embedding import get_embedding, EMBEDDING_MODEL_VERSION
+
+ELEMENTS_DIR = os.path.join('static', 'assets', 'Face Sketch Elements')
+DEFAULT_CANVAS_SIZE = (600, 600)
+# Upper bound for canvas and element dimensions, a bit above the creation UI's
+# full-window canvas; larger requests are rejected rather than rendered.
+MAX_CANVAS_SIZE = 2000
+# A composite that MTCNN does not recognise as a face is only embedded from
+# its bounding box if it has at least these element categories.
+CORE_CATEGORIES = {'head', 'eyes', 'nose', 'lips'}
+# The creation UI places about one element per category; allow some layering
+# on top of that but bound the work a single request can ask for.
+MAX_ELEMENTS = 32
+EMBEDDING_CACHE_SIZE = 256
+# Resized layers are evicted by total RGBA size rather than count, since one
+# layer can be anywhere from a few KB to MAX_CANVAS_SIZE^2 * 4 bytes (16 MB).
+RESIZED_LAYER_CACHE_BYTES = 256 * 1024 * 1024
+
+# Decoded RGBA layers keyed by element id ("<category>/<file name>", the same
+# path the creation UI uses under ELEMENTS_DIR).
+_layers = {}
+# Layers already resized to a given (width, height); moving an element around
+# the canvas keeps its size, so most edits hit this cache.
+_resized_layers = OrderedDict()
+_resized_layers_bytes = 0
+# Embeddings of recently rendered composites keyed by embedding model version
+# and canonical description.
+_embedding_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def load_element_layers(elements_dir=ELEMENTS_DIR):
+    """Decodes every sketch element PNG once and keeps the RGBA layers in memory."""
+    global _resized_layers_bytes
+    layers = {}
+    if not os.path.isdir(elements_dir):
+        print(f"⚠️ Sketch elements directory not found at {elements_dir}.")
+        return layers
+
+    for category in sorted(os.listdir(elements_dir)):
+        category_dir = os.path.join(elements_dir, category)
+        if not os.path.isdir(category_dir):
+            continue
+        for filename in sorted(os.listdir(category_dir)):
+            if not filename.lower().endswith('.png'):
+                continue
+            with Image.open(os.path.join(category_dir, filename)) as img:
+                layers[f'{category}/{filename}'] = img.convert('RGBA')
+
+    with _lock:
+        _layers.clear()
+        _layers.update(layers)
+        _resized_layers.clear()
+        _resized_layers_bytes = 0
+        _embedding_cache.clear()
+    return layers
+
+
+def list_elements():
+    """Returns the ids of all preloaded element layers."""
+    if not _layers:
+        load_element_layers()
+    return sorted(_layers)
+
+
+def _get_layer(element_id, width, height):
+    global _resized_layers_bytes
+    key = (element_id, width, height)
+    with _lock:
+        layer = _resized_layers.get(key)
+        if layer is not None:
+            _resized_layers.move_to_end(key)
+            return layer
+
+    base = _layers[element_id]
+    layer = base if base.size == (width, height) else base.resize((width, height), Image.LANCZOS)
+
+    size = width * height * 4
+    if size > RESIZED_LAYER_CACHE_BYTES // 8:
+        # Too large to be worth caching; would evict most other layers
+        return layer
+    with _lock:
+        if key not in _resized_layers:
+            _resized_layers[key] = layer
+            _resized_layers_bytes += size
+        while _resized_layers_bytes > RESIZED_LAYER_CACHE_BYTES:
+            (_, w, h), _ = _resized_layers.popitem(last=False)
+            _resized_layers_bytes -= w * h * 4
+    return layer
+
+
+def normalize_description(description):
+    """Validates a composite description and returns a hashable canonical form.
+
+    The description is a dict with an optional 'canvas' ({width, height}) and a
+    list of 'elements', each with an 'id', 'x', 'y' (top-left corner in canvas
+    pixels) and either a 'width' in pixels or a 'scale' relative to the
+    element's natural size. Elements are drawn in list order (later on top).
+
+    Raises ValueError for malformed descriptions or unknown element ids.
+    """
+    if not _layers:
+        load_element_layers()
+    if not isinstance(description, dict):
+        raise ValueError("Composite description must be a JSON object.")
+
+    canvas = description.get('canvas') or {}
+    if not isinstance(canvas, dict):
+        raise ValueError("Canvas must be a JSON object with width and height.")
+    try:
+        canvas_w = int(canvas.get('width', DEFAULT_CANVAS_SIZE[0]))
+        canvas_h = int(canvas.get('height', DEFAULT_CANVAS_SIZE[1]))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("Canvas width and height must be integers.")
+    if not (0 < canvas_w <= MAX_CANVAS_SIZE and 0 < canvas_h <= MAX_CANVAS_SIZE):
+        raise ValueError(f"Canvas width and height must be between 1 and {MAX_CANVAS_SIZE}.")
+
+    elements = description.get('elements')
+    if not isinstance(elements, list) or not elements:
+        raise ValueError("Composite description needs a non-empty 'elements' list.")
+    if len(elements) > MAX_ELEMENTS:
+        raise ValueError(f"A composite can have at most {MAX_ELEMENTS} elements.")
+
+    placed = []
+    for element in elements:
+        if not isinstance(element, dict):
+            raise ValueError("Each element must be a JSON object.")
+        element_id = element.get('id')
+        if not isinstance(element_id, str) or element_id not in _layers:
+            raise ValueError(f"Unknown sketch element: {element_id}")
+        natural_w, natural_h = _layers[element_id].size
+        try:
+            x = int(round(float(element.get('x', 0))))
+            y = int(round(float(element.get('y', 0))))
+            if element.get('width') is not None:
+                width = int(round(float(element['width'])))
+            else:
+                width = int(round(natural_w * float(element.get('scale', 1.0))))
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f"Invalid position or size for element {element_id}.")
+        # Keep the aspect ratio, as the creation UI does when resizing
+        height = max(1, int(round(width * natural_h / natural_w)))
+        if not (0 < width <= MAX_CANVAS_SIZE and height <= MAX_CANVAS_SIZE):
+            raise ValueError(f"Element {element_id} must be between 1 and {MAX_CANVAS_SIZE} pixels in size.")
+        if not (-width < x < canvas_w and -height < y < canvas_h):
+            raise ValueError(f"Element {element_id} lies outside the canvas.")
+        placed.append((element_id, x, y, width, height))
+
+    return (canvas_w, canvas_h), tuple(placed)
+
+
+def render_composite(description):
+    """Renders a composite description to an RGB PIL image on a white background.
+
+    Returns (image, bbox) where bbox is the (left, top, right, bottom) box
+    covering all placed elements, clipped to the canvas.
+    """
+    (canvas_w, canvas_h), placed = (
+        description if isinstance(description, tuple) else normalize_description(description)
+    )
+    canvas = Image.new('RGB', (canvas_w, canvas_h), (255, 255, 255))
+    left, top, right, bottom = canvas_w, canvas_h, 0, 0
+
+    for element_id, x, y, width, height in placed:
+        layer = _get_layer(element_id, width, height)
+        # Paste with the layer's own alpha as the mask; unlike alpha_composite
+        # this accepts elements hanging off the top/left edge of the canvas
+        canvas.paste(layer, (x, y), layer)
+        left, top = min(left, max(0, x)), min(top, max(0, y))
+        right, bottom = max(right, min(canvas_w, x + width)), max(bottom, min(canvas_h, y + height))
+
+    if right <= left or bottom <= top:
+        bbox = (0, 0, canvas_w, canvas_h)
+    else:
+        bbox = (left, top, right, bottom)
+    return canvas, bbox
+
+
+def embed_composite(description, version=None):
+    """Renders a composite and returns (embedding, face_detected), reusing recent results.
+
+    If MTCNN finds no face, a composite containing all CORE_CATEGORIES is
+    embedded from the bounding box of its elements (face_detected is False);
+    any other composite yields (None, False). Raises ValueError if the
+    description is invalid.
+    """
+    version = version or EMBEDDING_MODEL_VERSION
+    normalized = normalize_description(description)
+    key = (version, normalized)
+    with _lock:
+        result = _embedding_cache.get(key)
+        if result is not None:
+            _embedding_cache.move_to_end(key)
+            return result
+
+    image, bbox = render_composite(normalized)
+    face_tensor = preprocess_pil_image(image)
+    face_detected = face_tensor is not None
+    categories = {element_id.split('/', 1)[0] for element_id, *_ in normalized[1]}
+    if not face_detected and CORE_CATEGORIES <= categories:
+        face_tensor = crop_to_face_tensor(image, bbox)
+    result = (get_embedding(face_tensor, version), face_detected)
+
+    with _lock:
+        _embedding_cache[key] = result
+        while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+    return result
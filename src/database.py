@@ -1,30 +1,67 @@
 import os
 import pickle
+import tempfile
 import json
 import numpy as np
 from numpy.linalg import norm
-from src.preprocess import preprocess_image
-from src.embedding import get_embedding
-import pickle
+from collections import namedtuple
+from src.model_versions import EMBEDDING_MODEL_VERSION, LEGACY_MODEL_VERSION
 
 DB_PATH = "face_db.pkl"
+COMPONENT_DB_PATH = "component_db.pkl"
+
+# Gallery profiles together with the embedding model version they were built
+# with. Queries against an index must be embedded with the same version.
+FaceIndex = namedtuple('FaceIndex', ['version', 'profiles'])
+
 
-def load_database():
+def load_versioned_database(path=DB_PATH):
+    """Loads a pickled database and its embedding model version.
+
+    Returns (version, profiles). Databases saved before versioning are plain
+    dicts and are reported as LEGACY_MODEL_VERSION. A missing file yields
+    (None, {}).
+    """
+    if not os.path.exists(path):
+        return None, {}
+    with open(path, 'rb') as f:
+        data = pickle.load(f)
+    if isinstance(data, dict) and "embedding_version" in data and "profiles" in data:
+        return data["embedding_version"], data["profiles"]
+    return LEGACY_MODEL_VERSION, data
+
+def load_database(path=DB_PATH):
     """Loads the face database from a pickle file if it exists."""
-    if os.path.exists(DB_PATH):
-        with open(DB_PATH, 'rb') as f:
-            return pickle.load(f)
-    return {}
+    return load_versioned_database(path)[1]
 
-def save_database(db):
-    """Saves the face database to a pickle file."""
-    with open(DB_PATH, 'wb') as f:
-        pickle.dump(db, f)
+def save_database(db, version=None, path=DB_PATH):
+    """Saves the face database to a pickle file, tagged with its embedding model version.
 
-def build_database_from_photos(photos_dir="data/photos", metadata_path="data/metadata.json"):
+    The file is written to a uniquely named temporary file next to the target
+    and renamed over it, so readers never see a partially written database and
+    concurrent writers never share a temporary file.
     """
-    Scans a directory of photos, generates embeddings, and builds the database.
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)),
+                                     prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                     delete=False) as f:
+        tmp_path = f.name
+        try:
+            pickle.dump({"embedding_version": version or EMBEDDING_MODEL_VERSION, "profiles": db}, f)
+        except Exception:
+            f.close()
+            os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, path)
+
+def build_database_from_photos(photos_dir="data/photos", metadata_path="data/metadata.json", version=None):
     """
+    Scans a directory of photos, generates embeddings with the given embedding
+    model version, and builds the database.
+    """
+    # Imported here so loading/saving databases does not pull in torch and the models
+    from src.preprocess import preprocess_image
+    from src.embedding import get_embedding
+
     database = {}
     
     # Load metadata
@@ -47,7 +84,7 @@ def build_database_from_photos(photos_dir="data/photos", metadata_path="data/met
             face_tensor = preprocess_image(image_path)
             
             if face_tensor is not None:
-                emb = get_embedding(face_tensor)
+                emb = get_embedding(face_tensor, version)
                 
                 # Store the full profile in the database
                 database[name] = {
@@ -67,12 +104,33 @@ def l2_normalize(x, eps=1e-10):
     return x / n
 
 
+def profile_photo_paths(profile):
+    """Returns every source photo of a profile (merged profiles may have several)."""
+    paths = profile.get("photo_paths") or [profile.get("photo_path")]
+    return [p for p in paths if p]
+
+
+def profile_embeddings(profile):
+    """Returns every embedding stored for a profile.
+
+    Profiles merged by the duplicate finder (src/dedup.py) hold several
+    embeddings under 'embeddings'; plain profiles hold a single 'embedding'.
+    """
+    embs = profile.get("embeddings")
+    if embs:
+        return list(embs)
+    emb = profile.get("embedding")
+    return [emb] if emb is not None else []
+
+
 def find_best_match(sketch_embedding, database):
     """Finds the best match for a sketch embedding in the database.
 
     Returns (name, profile, distance, cosine_similarity)
     - distance: Euclidean (L2) distance (lower is better)
     - cosine_similarity: cosine similarity between normalized vectors (higher is better, typically 0..1)
+
+    Profiles with several embeddings are scored by their closest embedding.
     """
     best_match_name = None
     best_match_profile = None
@@ -84,31 +142,29 @@ def find_best_match(sketch_embedding, database):
     sketch_norm = l2_normalize(sketch_emb)
 
     for name, profile in database.items():
-        db_emb = np.asarray(profile["embedding"]).ravel()
+        for emb in profile_embeddings(profile):
+            db_emb = np.asarray(emb).ravel()
 
-        # Euclidean distance
-        dist = norm(sketch_emb - db_emb)
+            # Euclidean distance
+            dist = norm(sketch_emb - db_emb)
 
-        # Cosine similarity (on L2-normalized vectors)
-        db_norm = l2_normalize(db_emb)
-        cos_sim = float(np.dot(sketch_norm, db_norm))
+            # Cosine similarity (on L2-normalized vectors)
+            db_norm = l2_normalize(db_emb)
+            cos_sim = float(np.dot(sketch_norm, db_norm))
 
-        # Update best by Euclidean distance (primary) and also track best cosine
-        if dist < best_dist:
-            best_dist = dist
-            best_match_name = name
-            best_match_profile = profile
-            best_cos = cos_sim
+            # Update best by Euclidean distance (primary) and also track best cosine
+            if dist < best_dist:
+                best_dist = dist
+                best_match_name = name
+                best_match_profile = profile
+                best_cos = cos_sim
 
     return best_match_name, best_match_profile, best_dist, best_cos
 
 
-def load_component_database(path='component_db.pkl'):
+def load_component_database(path=COMPONENT_DB_PATH):
     """Loads a component (eyes/nose/mouth) database produced by build_component_db.py."""
-    if os.path.exists(path):
-        with open(path, 'rb') as f:
-            return pickle.load(f)
-    return {}
+    return load_versioned_database(path)[1]
 
 
 def find_best_component_match(sketch_embedding, component_db, part):
@@ -0,0 +1,239 @@
+import os
+import tempfile
+import numpy as np
+from multiprocessing import Pool
+from src.database import profile_embeddings, profile_photo_paths
+
+DEFAULT_THRESHOLD = 0.8
+# 4096 x 4096 float32 similarity tile = 64 MB per worker
+DEFAULT_BLOCK_SIZE = 4096
+# Clusters with more embeddings than this are not checked pairwise (and so
+# never merged automatically); they are almost always chains of weak links.
+MAX_CHECKED_CLUSTER_ROWS = 2048
+
+# Set in each worker process by _init_worker
+_matrix = None
+_owners = None
+
+
+def gallery_matrix(database):
+    """Stacks all gallery embeddings into one L2-normalized float32 matrix.
+
+    Returns (names, owners, matrix): `names` lists the identities, `owners[i]`
+    is the index in `names` that row i of `matrix` belongs to. Profiles that
+    already hold several embeddings contribute one row per embedding.
+    """
+    names = []
+    owners = []
+    rows = []
+    for name, profile in database.items():
+        embs = profile_embeddings(profile)
+        if not embs:
+            continue
+        names.append(name)
+        for emb in embs:
+            owners.append(len(names) - 1)
+            rows.append(np.asarray(emb, dtype=np.float32).ravel())
+
+    if not rows:
+        return names, np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+
+    matrix = np.vstack(rows)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.maximum(norms, 1e-10)
+    return names, np.asarray(owners, dtype=np.int64), matrix
+
+
+def _block_pairs(matrix, owners, start, block_size, threshold):
+    """Compares rows [start, start+block_size) against every row at or after `start`.
+
+    Only one similarity tile is held in memory at a time. Returns a list of
+    (owner_a, owner_b, similarity) with owner_a < owner_b.
+    """
+    n = matrix.shape[0]
+    stop = min(start + block_size, n)
+    block = matrix[start:stop]
+    pairs = []
+    for col in range(start, n, block_size):
+        col_stop = min(col + block_size, n)
+        sims = block @ matrix[col:col_stop].T
+        if col == start:
+            # Diagonal tile: keep the strict upper triangle only
+            sims = np.triu(sims, k=1)
+        rows_idx, cols_idx = np.nonzero(sims >= threshold)
+        for r, c in zip(rows_idx, cols_idx):
+            a, b = owners[start + r], owners[col + c]
+            if a == b:
+                continue
+            if a > b:
+                a, b = b, a
+            pairs.append((int(a), int(b), float(sims[r, c])))
+    return pairs
+
+
+def _init_worker(matrix_path, owners):
+    global _matrix, _owners
+    # Memory-map the shared matrix so workers do not each hold a private copy
+    _matrix = np.load(matrix_path, mmap_mode='r')
+    _owners = owners
+
+
+def _worker_block(args):
+    start, block_size, threshold = args
+    return _block_pairs(_matrix, _owners, start, block_size, threshold)
+
+
+def similar_pairs(matrix, owners, threshold=DEFAULT_THRESHOLD, block_size=DEFAULT_BLOCK_SIZE, workers=1):
+    """Blocked all-pairs cosine similarity join over the rows of `matrix`.
+
+    Yields (owner_a, owner_b, similarity) for every pair of rows from different
+    owners whose cosine similarity is at least `threshold`. The same owner pair
+    may be yielded more than once if the owners hold several embeddings.
+    """
+    n = matrix.shape[0]
+    starts = range(0, n, block_size)
+
+    if workers <= 1 or n <= block_size:
+        for start in starts:
+            yield from _block_pairs(matrix, owners, start, block_size, threshold)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        matrix_path = os.path.join(tmp_dir, 'gallery.npy')
+        np.save(matrix_path, matrix)
+        with Pool(workers, initializer=_init_worker, initargs=(matrix_path, owners)) as pool:
+            tasks = [(start, block_size, threshold) for start in starts]
+            for pairs in pool.imap_unordered(_worker_block, tasks):
+                yield from pairs
+
+
+def cluster_pairs(pairs, count):
+    """Groups owners connected by similar pairs (union-find).
+
+    Returns a list of clusters, each a dict with the sorted member indices and
+    the lowest/highest similarity of the links inside the cluster. Singletons
+    are omitted.
+    """
+    parent = list(range(count))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    link_sims = {}
+    for a, b, sim in pairs:
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[rb] = ra
+        key = (a, b)
+        link_sims[key] = max(sim, link_sims.get(key, -1.0))
+
+    members = {}
+    for a, b in link_sims:
+        root = find(a)
+        members.setdefault(root, set()).update((a, b))
+
+    stats = {}
+    for (a, b), sim in link_sims.items():
+        lo, hi = stats.get(find(a), (sim, sim))
+        stats[find(a)] = (min(lo, sim), max(hi, sim))
+
+    clusters = []
+    for root, idx in members.items():
+        lo, hi = stats[root]
+        clusters.append({"members": sorted(idx), "min_similarity": lo, "max_similarity": hi})
+    clusters.sort(key=lambda c: (-len(c["members"]), -c["max_similarity"]))
+    return clusters
+
+
+def min_pair_similarity(matrix, owners, members):
+    """Lowest similarity between any two members of a cluster (complete linkage).
+
+    Two members are compared by their most similar pair of embeddings. Returns
+    None if the cluster has too many embeddings to check.
+    """
+    # `owners` is sorted (gallery_matrix emits rows in owner order), so each
+    # member's rows are one contiguous range found by binary search
+    members = np.asarray(members)
+    lo = np.searchsorted(owners, members, side='left')
+    hi = np.searchsorted(owners, members, side='right')
+    counts = hi - lo
+    if counts.sum() > MAX_CHECKED_CLUSTER_ROWS:
+        return None
+    rows = np.concatenate([np.arange(a, b) for a, b in zip(lo, hi)])
+    sims = matrix[rows] @ matrix[rows].T
+    # reduceat over the member start offsets gives the member x member maximum
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+    member_sims = np.maximum.reduceat(np.maximum.reduceat(sims, starts, axis=0), starts, axis=1)
+    np.fill_diagonal(member_sims, np.inf)
+    return float(member_sims.min())
+
+
+def find_duplicate_clusters(database, threshold=DEFAULT_THRESHOLD, block_size=DEFAULT_BLOCK_SIZE, workers=1):
+    """Finds groups of gallery identities whose embeddings look like the same person.
+
+    Clusters are connected components of above-threshold links (single
+    linkage), so a chain A~B~C can join two different people. Each cluster
+    therefore also reports the lowest similarity between any two of its
+    members; only clusters where that meets the threshold are merged.
+
+    Returns a list of clusters:
+    {"names": [...], "min_similarity", "max_similarity", "min_pair_similarity"}.
+    """
+    names, owners, matrix = gallery_matrix(database)
+    if matrix.shape[0] < 2:
+        return []
+
+    pairs = similar_pairs(matrix, owners, threshold, block_size, workers)
+    clusters = cluster_pairs(pairs, len(names))
+    for cluster in clusters:
+        members = cluster.pop("members")
+        cluster["min_pair_similarity"] = min_pair_similarity(matrix, owners, members)
+        cluster["names"] = [names[i] for i in members]
+    return clusters
+
+
+def is_mergeable(cluster, threshold=DEFAULT_THRESHOLD):
+    """True if every pair of members in the cluster meets `threshold`."""
+    lowest = cluster.get("min_pair_similarity")
+    return lowest is not None and lowest >= threshold
+
+
+def merge_clusters(database, clusters, threshold=DEFAULT_THRESHOLD):
+    """Merges clusters into a single identity holding several embeddings.
+
+    Only clusters whose members are all pairwise similar (see is_mergeable)
+    are merged. The first name of each such cluster is kept; its profile
+    gains the embeddings, photo paths and names of the other members (as
+    'aliases'), which are removed from the database. The database is
+    modified in place; returns the clusters that were merged.
+    """
+    merged = []
+    for cluster in clusters:
+        if not is_mergeable(cluster, threshold):
+            continue
+        present = [name for name in cluster["names"] if name in database]
+        if len(present) < 2:
+            continue
+        primary_name, others = present[0], present[1:]
+        primary = database[primary_name]
+
+        embeddings = list(profile_embeddings(primary))
+        photo_paths = profile_photo_paths(primary)
+        aliases = list(primary.get("aliases", []))
+
+        for name in others:
+            profile = database.pop(name)
+            embeddings.extend(profile_embeddings(profile))
+            photo_paths.extend(profile_photo_paths(profile))
+            aliases.append(name)
+            aliases.extend(profile.get("aliases", []))
+
+        primary["embeddings"] = embeddings
+        primary["photo_paths"] = photo_paths
+        primary["aliases"] = aliases
+        merged.append(cluster)
+
+    return merged
@@ -1,19 +1,54 @@
+import threading
 import torch
 from facenet_pytorch import InceptionResnetV1
+from src.model_versions import EMBEDDING_MODEL_VERSION
 
-# Load InceptionResnetV1 (pretrained on VGGFace2)
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-resnet = InceptionResnetV1(pretrained='vggface2').eval().to(device)
 
-def get_embedding(face_tensor):
+
+# Embedding model versions. A version names both the network and the
+# preprocessing it expects (MTCNN 160x160 crops, fixed standardization), so
+# embeddings are only comparable when they carry the same version string.
+EMBEDDING_MODELS = {
+    'facenet-vggface2-v1': lambda: (InceptionResnetV1(pretrained='vggface2').eval().to(device), device),
+    'facenet-casia-webface-v1': lambda: (InceptionResnetV1(pretrained='casia-webface').eval().to(device), device),
+}
+_models = {}
+# Guards _load_locks only; each version is built under its own lock so that
+# loading (and possibly downloading) one model never stalls queries that use
+# another, already loaded one.
+_models_lock = threading.Lock()
+_load_locks = {}
+
+
+def get_model(version=None):
+    """Returns (model, device) for an embedding model version, loading it on first use."""
+    version = version or EMBEDDING_MODEL_VERSION
+    loaded = _models.get(version)
+    if loaded is not None:
+        return loaded
+    if version not in EMBEDDING_MODELS:
+        raise ValueError(f"Unknown embedding model version: {version}")
+
+    with _models_lock:
+        load_lock = _load_locks.setdefault(version, threading.Lock())
+    with load_lock:
+        if version not in _models:
+            _models[version] = EMBEDDING_MODELS[version]()
+        return _models[version]
+
+
+def get_embedding(face_tensor, version=None):
     """
-    Generates a 512-dimensional embedding for a given face tensor.
+    Generates a 512-dimensional embedding for a given face tensor (or a batch
+    of them) using the given embedding model version.
     """
     if face_tensor is None:
         return None
-        
+
+    model, model_device = get_model(version)
     with torch.no_grad():
         # Pass the tensor directly to the model
-        embedding = resnet(face_tensor)
-        
-    return embedding.cpu().numpy()
\ No newline at end of file
+        embedding = model(face_tensor.to(model_device))
+
+    return embedding.cpu().numpy()
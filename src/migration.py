@@ -0,0 +1,153 @@
+import threading
+import time
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from src.preprocess import preprocess_image
+from src.embedding import get_embedding, get_model, EMBEDDING_MODELS
+from src.database import FaceIndex, profile_photo_paths
+
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_PREPROCESS_WORKERS = 4
+
+
+class EmbeddingMigration:
+    """Re-embeds the gallery with a new embedding model version in a background thread.
+
+    Queries keep using the active index while the migration runs. When every
+    profile has been re-embedded, profiles added or removed in the meantime
+    are reconciled under `lock` and `activate` is called with the new
+    FaceIndex, so the switch happens in one step and no query ever compares
+    embeddings from two versions.
+
+    - get_active_index: callable returning the FaceIndex currently served
+    - activate: callable taking the new FaceIndex; called while holding `lock`
+    - lock: the lock that also guards every other change of the active index
+    """
+
+    def __init__(self, get_active_index, activate, lock, target_version,
+                 batch_size=DEFAULT_BATCH_SIZE, workers=DEFAULT_PREPROCESS_WORKERS):
+        self.get_active_index = get_active_index
+        self.activate = activate
+        self.lock = lock
+        self.target_version = target_version
+        self.batch_size = max(1, int(batch_size))
+        self.workers = max(1, int(workers))
+        self.state = 'pending'
+        self.source_version = None
+        self.total = 0
+        self.done = 0
+        self.failed = []
+        self.failed_photos = []
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._thread = None
+
+    def start(self):
+        # Fail fast on unknown versions; the model itself is loaded on the
+        # migration thread so callers (and queries) are not held up by it
+        if self.target_version not in EMBEDDING_MODELS:
+            raise ValueError(f"Unknown embedding model version: {self.target_version}")
+        self._thread = threading.Thread(target=self._run, name='embedding-migration', daemon=True)
+        self._thread.start()
+        return self
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self):
+        return {
+            "state": self.state,
+            "source_version": self.source_version,
+            "target_version": self.target_version,
+            "total": self.total,
+            "done": self.done,
+            "failed": list(self.failed),
+            "failed_photos": list(self.failed_photos),
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    def _run(self):
+        self.state = 'running'
+        self.started_at = time.time()
+        try:
+            get_model(self.target_version)
+            snapshot = self.get_active_index()
+            self.source_version = snapshot.version
+            self.total = len(snapshot.profiles)
+            profiles = self._reembed(snapshot.profiles)
+
+            with self.lock:
+                # Reconcile with changes made to the active index while we ran
+                current = self.get_active_index()
+                for name in list(profiles):
+                    if name not in current.profiles:
+                        del profiles[name]
+                added = {name: profile for name, profile in current.profiles.items()
+                         if name not in snapshot.profiles
+                         or profile_photo_paths(profile) != profile_photo_paths(snapshot.profiles[name])}
+                self.total += len(added)
+                profiles.update(self._reembed(added))
+                self.activate(FaceIndex(self.target_version, profiles))
+            self.state = 'completed'
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            print(f"⚠️ Embedding migration to {self.target_version} failed: {e}")
+        finally:
+            self.finished_at = time.time()
+
+    def _reembed(self, profiles):
+        """Re-embeds every photo of `profiles` with the target version.
+
+        Photos are decoded and run through MTCNN on a thread pool one batch
+        ahead of the embedding model, which then embeds each batch in a single
+        forward pass. Photos that cannot be re-embedded are reported in
+        `failed_photos`; their profile keeps the embeddings of its other photos.
+        Only profiles with no re-embedded photo at all are left out (and
+        reported in `failed`) rather than kept with old-version vectors.
+        """
+        items = [(name, path) for name, profile in profiles.items() for path in profile_photo_paths(profile)]
+        batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        embeddings = {}
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            def submit(batch):
+                return [executor.submit(preprocess_image, path) for _, path in batch]
+
+            pending = submit(batches[0]) if batches else []
+            for i, batch in enumerate(batches):
+                current, pending = pending, (submit(batches[i + 1]) if i + 1 < len(batches) else [])
+                faces = []
+                owners = []
+                for (name, path), future in zip(batch, current):
+                    try:
+                        face = future.result()
+                    except Exception as e:
+                        print(f"⚠️ Could not read {path}: {e}")
+                        face = None
+                    if face is None:
+                        self.failed_photos.append({"name": name, "photo_path": path})
+                        continue
+                    faces.append(face)
+                    owners.append(name)
+
+                if faces:
+                    batch_embs = get_embedding(torch.cat(faces), self.target_version)
+                    for name, emb in zip(owners, batch_embs):
+                        embeddings.setdefault(name, []).append(emb[None, :])
+
+        migrated = {}
+        for name, profile in profiles.items():
+            if name not in embeddings:
+                self.failed.append(name)
+                continue
+            new_profile = dict(profile)
+            new_profile["embedding"] = embeddings[name][0]
+            if "embeddings" in profile or len(embeddings[name]) > 1:
+                new_profile["embeddings"] = embeddings[name]
+            migrated[name] = new_profile
+            self.done += 1
+        return migrated
@@ -0,0 +1,10 @@
+import os
+
+# Kept free of torch/facenet imports so database tooling (e.g. the duplicate
+# finder) can read and write versioned databases without loading any model.
+
+# Version of databases pickled before versioning was introduced
+LEGACY_MODEL_VERSION = 'facenet-vggface2-v1'
+# Version used to build new databases; a database tagged with another version
+# is migrated to this one in the background when the app starts.
+EMBEDDING_MODEL_VERSION = os.environ.get('EMBEDDING_MODEL_VERSION', LEGACY_MODEL_VERSION)
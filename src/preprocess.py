@@ -1,5 +1,6 @@
+import numpy as np
 import torch
-from facenet_pytorch import MTCNN
+from facenet_pytorch import MTCNN, fixed_image_standardization
 from PIL import Image
 
 # Device setup
@@ -7,17 +8,62 @@ device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 # Initialize MTCNN
 mtcnn = MTCNN(image_size=160, margin=0, min_face_size=20, device=device)
+# Same settings, but returns every face in an image (used for video frames)
+mtcnn_multi = MTCNN(image_size=160, margin=0, min_face_size=20, keep_all=True, device=device)
 
 def preprocess_image(image_path):
     """Load image, detect & align face using MTCNN."""
     img = Image.open(image_path).convert('RGB')
-    face = mtcnn(img)
+    face = preprocess_pil_image(img)
     if face is None:
         print(f"⚠️ No face detected in {image_path}")
+    return face
+
+
+def preprocess_pil_image(img):
+    """Detect & align a face in an in-memory RGB PIL image using MTCNN."""
+    face = mtcnn(img)
+    if face is None:
         return None
     return face.unsqueeze(0).to(device)  # Add batch dimension
 
 
+def crop_to_face_tensor(img, box):
+    """Crop `box` (left, top, right, bottom) from an RGB PIL image without detection.
+
+    The crop is resized to 160x160 and standardized the same way MTCNN
+    standardizes its own crops, giving a (1, 3, 160, 160) tensor.
+    """
+    crop = img.crop(box).resize((160, 160))
+    face = fixed_image_standardization(torch.tensor(np.array(crop)).permute(2, 0, 1).float())
+    return face.unsqueeze(0).to(device)
+
+
+def detect_faces_batch(images):
+    """Detect & align every face in a batch of RGB PIL images using MTCNN.
+
+    Images of the same size are detected in a single MTCNN pass. Returns one
+    list per image of (box, probability, face_tensor) tuples, where box is
+    [x1, y1, x2, y2] in image pixels and face_tensor is (3, 160, 160).
+    """
+    results = [[] for _ in images]
+    # MTCNN can only stack same-sized images into one batch
+    by_size = {}
+    for i, img in enumerate(images):
+        by_size.setdefault(img.size, []).append(i)
+
+    for indices in by_size.values():
+        batch = [images[i] for i in indices]
+        batch_boxes, batch_probs = mtcnn_multi.detect(batch)
+        batch_faces = mtcnn_multi.extract(batch, batch_boxes, None)
+        for i, boxes, probs, faces in zip(indices, batch_boxes, batch_probs, batch_faces):
+            if boxes is None or faces is None:
+                continue
+            for box, prob, face in zip(boxes, probs, faces):
+                results[i].append(([float(v) for v in box], float(prob), face))
+    return results
+
+
 def preprocess_component_image(image_path):
     """Preprocess a single-component image (eye/nose/mouth).
 
@@ -1,16 +1,33 @@
 from src.preprocess import preprocess_image
 from src.embedding import get_embedding
 from src.database import find_best_match
+from src.composite import embed_composite
 
-def recognize_sketch(sketch_path, database):
+def recognize_sketch(sketch_path, database, version=None):
     """
-    Recognizes a sketch by comparing it against the provided database.
+    Recognizes a sketch by comparing it against the provided database. The
+    sketch is embedded with `version`, which must be the database's version.
     """
     sketch_face = preprocess_image(sketch_path)
     if sketch_face is None:
-        return None, None, None
+        return None, None, None, None
     
-    sketch_emb = get_embedding(sketch_face)
+    sketch_emb = get_embedding(sketch_face, version)
     name, profile, dist, cos_sim = find_best_match(sketch_emb, database)
 
-    return name, profile, dist, cos_sim
\ No newline at end of file
+    return name, profile, dist, cos_sim
+
+def recognize_composite(description, database, version=None):
+    """
+    Renders a composite description on the server and compares it against the
+    provided database, embedding it with the database's `version`. Returns
+    (name, profile, distance, cosine_similarity, face_detected); everything
+    but face_detected is None if the composite could not be embedded. Raises
+    ValueError if the description is invalid.
+    """
+    sketch_emb, face_detected = embed_composite(description, version)
+    if sketch_emb is None:
+        return None, None, None, None, False
+    name, profile, dist, cos_sim = find_best_match(sketch_emb, database)
+
+    return name, profile, dist, cos_sim, face_detected
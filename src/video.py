@@ -0,0 +1,245 @@
+import os
+import queue
+import threading
+import numpy as np
+import torch
+from PIL import Image
+from src.preprocess import detect_faces_batch
+from src.embedding import get_embedding
+from src.database import find_best_match
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+DEFAULT_SEQUENCE_FPS = 25.0
+
+# Adaptive sampling: a frame is sampled when at least MIN_INTERVAL seconds
+# passed and the scene changed by MOTION_THRESHOLD (mean absolute difference
+# of a 64x64 grayscale thumbnail, 0..255), or MAX_INTERVAL seconds passed.
+MIN_INTERVAL = 0.2
+MAX_INTERVAL = 2.0
+MOTION_THRESHOLD = 6.0
+
+DETECT_BATCH_SIZE = 8
+FRAME_QUEUE_SIZE = 32
+# Tracking: detections overlapping a track's last box by at least this IoU
+# continue the track; tracks unseen for MAX_TRACK_GAP sampled frames end.
+TRACK_IOU = 0.3
+MAX_TRACK_GAP = 5
+# Each track is embedded at most this many times (its first detection, then
+# only when a detection is more confident than any seen before)
+MAX_EMBEDDINGS_PER_TRACK = 3
+# Raw cosine similarity a face needs to its nearest gallery profile to count
+# as a match. find_best_match always returns the nearest profile, so without
+# a cut-off every passer-by would be reported under some gallery name.
+MIN_MATCH_SIMILARITY = 0.6
+
+_END = object()
+
+
+def _read_video(path, emit, stop):
+    import cv2
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video {path}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or DEFAULT_SEQUENCE_FPS
+    index = 0
+    try:
+        while not stop.is_set():
+            ok, frame = capture.read()
+            if not ok:
+                break
+            emit(index, index / fps, lambda frame=frame: Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+            index += 1
+    finally:
+        capture.release()
+
+
+def _read_sequence(path, emit, stop, fps):
+    files = sorted(f for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTENSIONS))
+    for index, filename in enumerate(files):
+        if stop.is_set():
+            break
+        emit(index, index / fps, lambda filename=filename: Image.open(os.path.join(path, filename)).convert('RGB'))
+
+
+def iter_sampled_frames(source, stop, sequence_fps=DEFAULT_SEQUENCE_FPS,
+                        min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, motion_threshold=MOTION_THRESHOLD):
+    """Decodes a video file or image-sequence directory on a background thread.
+
+    Yields (frame_index, timestamp_seconds, PIL image) for adaptively sampled
+    frames: static scenes are sampled every `max_interval` seconds, changing
+    scenes up to every `min_interval` seconds. Setting `stop` ends decoding.
+    """
+    frames = queue.Queue(maxsize=FRAME_QUEUE_SIZE)
+    state = {"last_time": None, "last_thumb": None}
+
+    def put(item):
+        # Give up once the consumer is gone instead of blocking on a full queue
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def emit(index, timestamp, decode):
+        last_time = state["last_time"]
+        if last_time is not None and timestamp - last_time < min_interval:
+            return
+        img = decode()
+        thumb = np.asarray(img.convert('L').resize((64, 64)), dtype=np.float32)
+        if last_time is not None and timestamp - last_time < max_interval:
+            if np.abs(thumb - state["last_thumb"]).mean() < motion_threshold:
+                return
+        state["last_time"], state["last_thumb"] = timestamp, thumb
+        put((index, timestamp, img))
+
+    def decode():
+        try:
+            if os.path.isdir(source):
+                _read_sequence(source, emit, stop, sequence_fps)
+            else:
+                _read_video(source, emit, stop)
+            put(_END)
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=decode, name='frame-decoder', daemon=True)
+    thread.start()
+    try:
+        while True:
+            try:
+                item = frames.get(timeout=0.5)
+            except queue.Empty:
+                # The decoder skips enqueuing _END once `stop` is set, so poll
+                # instead of waiting on a sentinel that may never come
+                if stop.is_set() or (not thread.is_alive() and frames.empty()):
+                    return
+                continue
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def _iou(a, b):
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class FaceTracker:
+    """Greedy IoU tracker linking face detections across consecutive sampled frames."""
+
+    def __init__(self, iou_threshold=TRACK_IOU, max_gap=MAX_TRACK_GAP):
+        self.iou_threshold = iou_threshold
+        self.max_gap = max_gap
+        self.tracks = {}
+        self._next_id = 1
+        self._step = 0
+
+    def update(self, detections):
+        """Assigns a track to each (box, prob, face) detection of one frame.
+
+        Returns a list of (track, detection) pairs. A track is a dict with
+        'id', 'box', 'best_prob', 'embedded' (count) and 'best' (best match so far).
+        """
+        self._step += 1
+        for track_id in [t for t, track in self.tracks.items() if self._step - track["last_step"] > self.max_gap]:
+            del self.tracks[track_id]
+
+        candidates = sorted(
+            ((_iou(track["box"], det[0]), track_id, d) for d, det in enumerate(detections)
+             for track_id, track in self.tracks.items()),
+            reverse=True,
+        )
+        assigned = {}
+        used_tracks = set()
+        for iou, track_id, d in candidates:
+            if iou < self.iou_threshold:
+                break
+            if d in assigned or track_id in used_tracks:
+                continue
+            assigned[d] = self.tracks[track_id]
+            used_tracks.add(track_id)
+
+        pairs = []
+        for d, det in enumerate(detections):
+            track = assigned.get(d)
+            if track is None:
+                track = {"id": self._next_id, "best_prob": -1.0, "embedded": 0, "best": None}
+                self.tracks[self._next_id] = track
+                self._next_id += 1
+            track["box"] = det[0]
+            track["last_step"] = self._step
+            pairs.append((track, det))
+        return pairs
+
+
+def search_video(source, database, version=None, batch_size=DETECT_BATCH_SIZE, stop=None,
+                 min_similarity=MIN_MATCH_SIMILARITY, **sampling):
+    """Searches a video file or image sequence for faces from the gallery.
+
+    Frames are decoded and sampled on a background thread, faces are detected
+    in batches of `batch_size` frames, tracked across frames, and the crops
+    selected for embedding are embedded in one batch per frame batch. Yields a
+    dict for each track whose best gallery match (with cosine similarity of at
+    least `min_similarity`) is new or improved:
+    {track_id, frame, time, box, name, profile, distance, cosine}.
+    """
+    stop = stop or threading.Event()
+    tracker = FaceTracker()
+    frames = iter_sampled_frames(source, stop, **sampling)
+    try:
+        batch = []
+        for frame in frames:
+            batch.append(frame)
+            if len(batch) >= batch_size:
+                yield from _search_batch(batch, tracker, database, version, min_similarity)
+                batch = []
+        if batch:
+            yield from _search_batch(batch, tracker, database, version, min_similarity)
+    finally:
+        stop.set()
+        frames.close()
+
+
+def _search_batch(batch, tracker, database, version, min_similarity):
+    detections = detect_faces_batch([img for _, _, img in batch])
+
+    # Frames are tracked in order; only pick the crops worth embedding
+    to_embed = []
+    for (index, timestamp, _), frame_dets in zip(batch, detections):
+        for track, (box, prob, face) in tracker.update(frame_dets):
+            if track["embedded"] >= MAX_EMBEDDINGS_PER_TRACK or prob <= track["best_prob"]:
+                continue
+            track["best_prob"] = prob
+            track["embedded"] += 1
+            to_embed.append((track, index, timestamp, box, face))
+
+    if not to_embed or not database:
+        return
+
+    embeddings = get_embedding(torch.stack([face for *_, face in to_embed]), version)
+    for (track, index, timestamp, box, _), emb in zip(to_embed, embeddings):
+        name, profile, dist, cos_sim = find_best_match(emb, database)
+        if name is None or cos_sim < min_similarity:
+            continue
+        best = track["best"]
+        if best is not None and dist >= best["distance"]:
+            continue
+        track["best"] = {
+            "track_id": track["id"],
+            "frame": index,
+            "time": round(timestamp, 3),
+            "box": [round(v, 1) for v in box],
+            "name": name,
+            "profile": profile,
+            "distance": float(dist),
+            "cosine": float(cos_sim),
+        }
+        yield track["best"]